@@ -9,18 +9,32 @@ app_v2.py
   • Google Analytics は簡略版
 """
 
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify
 from flask_cors import CORS
-from recommend_engine import EmbeddingCache, Episode, get_episodes
-from sklearn.metrics.pairwise import cosine_similarity
+from json_provider import JSONProvider
+from recommend_engine import (
+    EmbeddingCache, Episode, build_search_text, build_tag_mask, get_episodes,
+    inference_mode, search_episodes,
+)
+from recommend_kernel import top_k_indices
 import numpy as np
 import logging
 import os
+import threading
+import functools
+import hashlib
+
+try:
+    from gevent import monkey
+    from gevent.threadpool import ThreadPool
+except ImportError:  # gevent なし（flask run / スレッドワーカー）
+    monkey = None
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
 app = Flask(__name__, static_folder="static", template_folder="static")
+app.json = JSONProvider(app)
 CORS(app)
 
 # ─── 定数 ────────────────────────────────────────────────
@@ -39,19 +53,192 @@ THEMES = [
     "西洋", "仏教", "日本哲学",  "正義", "ヘレニズム", "雑談" ,"禅", "唯識"
 ]
 
+# /api/config は毎回同じ内容なので起動時に1回だけシリアライズしておく
+CONFIG_JSON = app.json.dumps({
+    "philosophers": PHILOSOPHERS,
+    "themes": THEMES,
+})
+
 # ─── キャッシュ初期化 ────────────────────────────────────
 CACHE = None
 EPISODES = []
+EMB_ALL = None  # (N, D) float32、行ごとに L2 正規化済み（行番号 = EPISODES の添字）
+PHIL_VOCAB, PHIL_MASK = {}, None    # 哲学者タグ → 列番号、(N, P) bool
+THEME_VOCAB, THEME_MASK = {}, None  # テーマタグ → 列番号、(N, T) bool
+# キーワード検索用: 全エピソードの小文字化済み「タイトル\0要約\0」を連結した文字列と、
+# 各エピソードの開始位置（bisect で検索位置 → エピソード番号に戻す）
+SEARCH_TEXT = ""
+SEARCH_STARTS = []
+# hash(候補行, 丸めたクエリ Embedding) → 上位エピソードの行番号
+# encode 後に引くので省けるのは類似度計算だけ（encode 自体は毎回かかる）
+SEMANTIC_CACHE = {}
+SEMANTIC_CACHE_SIZE = 4096
+MODEL = None    # Embedding モデル（recommend_engine と同じインスタンス）
+_INIT_LOCK = threading.Lock()
+
+# gevent ワーカー下では encode（CPU 処理）を少数の OS スレッドに逃がし、
+# イベントループ（他のリクエスト）を止めない
+ENCODE_WORKERS = 2
+ENCODE_POOL = None
+if monkey is not None and monkey.is_module_patched("threading"):
+    ENCODE_POOL = ThreadPool(ENCODE_WORKERS)
+
+def tag_hits(mask: np.ndarray, vocab: dict, query: tuple) -> np.ndarray:
+    """クエリのタグを1つでも持つエピソードか (N,) bool"""
+    cols = [vocab[tag] for tag in query if tag in vocab]
+    return mask[:, cols].any(axis=1)
+
+def load_model(cache: EmbeddingCache):
+    """Embedding モデルを起動時に1回だけロード（recommend_engine と同じインスタンスを共有）"""
+    global MODEL
+    if MODEL is None:
+        cache.load_model()
+        model = cache.model
+        # 初回 encode の重み展開・カーネル初期化を済ませておく
+        with inference_mode():
+            model.encode("warmup", convert_to_numpy=True)
+        MODEL = model
+
+def _encode(text: str) -> np.ndarray:
+    # inference_mode はスレッドごとの設定なので、実際に encode するスレッド内で入る
+    with inference_mode():
+        return MODEL.encode(text, convert_to_numpy=True, normalize_embeddings=True)
+
+def encode_query(text: str) -> np.ndarray:
+    """クエリ文を正規化済み Embedding に変換"""
+    if ENCODE_POOL is None:
+        return _encode(text)
+    return ENCODE_POOL.apply(_encode, (text,))
+
+def _build_cache():
+    """DB・行列・タグ行列・検索文字列・モデルを読み込む（呼び出し側で _INIT_LOCK を取る）"""
+    global CACHE, EPISODES, EMB_ALL, PHIL_VOCAB, PHIL_MASK, THEME_VOCAB, THEME_MASK
+    global SEARCH_TEXT, SEARCH_STARTS
+    log.info("📦 キャッシュ読み込み中...")
+    cache = EmbeddingCache()
+    # 行列は recommend_engine が読み込んだもの（.npy の mmap、無ければ組み直した行列）をそのまま使う
+    EPISODES, EMB_ALL = cache.load_episodes_with_matrix()
+    PHIL_VOCAB, PHIL_MASK = build_tag_mask([ep.philosophers for ep in EPISODES])
+    THEME_VOCAB, THEME_MASK = build_tag_mask([ep.themes for ep in EPISODES])
+    SEARCH_TEXT, SEARCH_STARTS = build_search_text(EPISODES)
+    load_model(cache)
+    _discover_core.cache_clear()
+    SEMANTIC_CACHE.clear()
+    CACHE = cache
+    log.info(f"✅ {len(EPISODES)} 件読み込み完了")
 
 def init_cache():
-    global CACHE, EPISODES
-    if CACHE is None:
-        log.info("📦 キャッシュ読み込み中...")
-        from recommend_engine import EmbeddingCache
-        cache = EmbeddingCache()
-        EPISODES = cache.load_all_episodes()
-        CACHE = cache
-        log.info(f"✅ {len(EPISODES)} 件読み込み完了")
+    if CACHE is not None:
+        return
+    # Flask はマルチスレッドなので初回の初期化は1スレッドだけが行う
+    with _INIT_LOCK:
+        if CACHE is None:
+            if ENCODE_POOL is None:
+                _build_cache()
+            else:
+                # gevent ワーカー下ではモデル読み込み・行列構築（CPU 処理）を OS スレッドで行い、
+                # その間も /api/health など他のリクエストを処理できるようにする
+                ENCODE_POOL.apply(_build_cache)
+
+# フォールバック時のメッセージ
+FALLBACK_MESSAGES = {
+    0: None,  # 厳密なマッチ、通知なし
+    1: "⚠️ マッチ数が少ないため、関連エピソードも含めて表示しています",
+    2: "⚠️ マッチ数が少ないため、キーワード検索の結果を表示しています",
+    3: "⚠️ マッチ数が少ないため、最新のエピソードを表示しています"
+}
+
+@functools.lru_cache(maxsize=4096)
+def _discover_core(philosophers: tuple, themes: tuple, search_query: str) -> dict:
+    """
+    フォールバック付き検索本体（正規化済みクエリ単位でメモ化）
+
+    完全一致しなかったクエリ文でも、Embedding がほぼ同じなら
+    SEMANTIC_CACHE の順位を再利用する
+    """
+    top_k = 5  # ← 常に5個に固定
+
+    # ========== フォールバックロジック開始 ==========
+    # 候補は EPISODES の添字だけで扱い、dict 化は最終的な上位件数分のみ
+    
+    all_idx = np.arange(len(EPISODES))
+    candidates = all_idx
+    fallback_level = 0
+    
+    # 哲学者・テーマそれぞれのヒットを1回だけ計算し、AND/OR はその組み合わせで作る
+    phil_hit = tag_hits(PHIL_MASK, PHIL_VOCAB, philosophers)
+    theme_hit = tag_hits(THEME_MASK, THEME_VOCAB, themes)
+    
+    # Level 0: 両方マッチ（哲学者 AND テーマ）
+    if philosophers and themes:
+        candidates = np.flatnonzero(phil_hit & theme_hit)
+        
+        # 5個未満ならフォールバック
+        if len(candidates) < 5:
+            fallback_level = 1
+            # Level 1: 片方マッチ（哲学者 OR テーマ）
+            candidates = np.flatnonzero(phil_hit | theme_hit)
+    
+    # Level 1.5: 哲学者またはテーマのいずれかのみ指定
+    elif philosophers or themes:
+        candidates = np.flatnonzero(phil_hit | theme_hit)
+        
+        # 5個未満ならフォールバック
+        if len(candidates) < 5:
+            fallback_level = 2
+    
+    # Level 2: キーワード検索（サブテーマ）
+    if len(candidates) < 5 and search_query:
+        fallback_level = 2
+        candidates = search_episodes(SEARCH_TEXT, SEARCH_STARTS, search_query.lower())
+    
+    # Level 3: すべてのエピソード（新しい順）
+    if len(candidates) < 5:
+        fallback_level = 3
+        candidates = all_idx
+    
+    # ========== フォールバックロジック終了 ==========
+    
+    cand_idx = np.asarray(candidates, dtype=np.intp)
+
+    # ステップ2: スコア計算 → TOP K を取得（常に5個）
+    if search_query and len(cand_idx) > 0 and EMB_ALL.shape[1] > 0:
+        q = encode_query(search_query).astype(np.float32)
+
+        # 候補行の配列をそのままキーにすると件数に比例して膨らむので 16 バイトのハッシュにする
+        h = hashlib.blake2b(cand_idx.tobytes(), digest_size=16)
+        h.update(np.round(q, 2).tobytes())
+        key = h.digest()
+        top = SEMANTIC_CACHE.get(key)
+        if top is None:
+            # 候補の行をまとめて1回の行列積でコサイン類似度を計算
+            # 全件が候補のときは行の抜き出し（コピー）をせずそのまま掛ける
+            if len(cand_idx) == len(EPISODES):
+                scores = EMB_ALL @ q
+            else:
+                scores = EMB_ALL[cand_idx] @ q
+            top = cand_idx[top_k_indices(scores, top_k)]
+
+            if len(SEMANTIC_CACHE) >= SEMANTIC_CACHE_SIZE:
+                SEMANTIC_CACHE.clear()
+            SEMANTIC_CACHE[key] = top
+    else:
+        # タグのみの場合は候補の並び順（先頭優先）
+        top = cand_idx[:top_k]
+
+    results = [
+        {
+            "notion_id": EPISODES[i].notion_id,
+            "title": EPISODES[i].title,
+            "url": EPISODES[i].url,
+            "summary": EPISODES[i].summary,
+            "episode_type": EPISODES[i].episode_type,
+            "difficulty": EPISODES[i].difficulty,
+        }
+        for i in top
+    ]
+
+    return {"results": results, "fallback_level": fallback_level}
 
 # ─────────────────────────────────────────────────────────
 # API エンドポイント
@@ -60,10 +247,7 @@ def init_cache():
 @app.route("/api/config", methods=["GET"])
 def api_config():
     """メタデータ配信"""
-    return jsonify({
-        "philosophers": PHILOSOPHERS,
-        "themes": THEMES,
-    })
+    return Response(CONFIG_JSON, mimetype="application/json")
 
 
 @app.route("/api/discover", methods=["POST"])
@@ -93,122 +277,31 @@ def api_discover():
         init_cache()
         
         data = request.json or {}
-        philosophers = data.get("philosophers", [])
-        themes = data.get("themes", [])
+        # null が送られても空リストとして扱う（キャッシュキーを作るときに反復するため）
+        philosophers = data.get("philosophers") or []
+        themes = data.get("themes") or []
         search_query = data.get("search_query", "").strip()
-        top_k = 5  # ← 常に5個に固定
         
         if not philosophers and not themes and not search_query:
             return jsonify({
                 "error": "philosophers, themes, search_query のいずれかを指定してください"
             }), 400
         
-        # ========== フォールバックロジック開始 ==========
-        
-        candidates = EPISODES
-        fallback_level = 0
-        
-        # Level 0: 両方マッチ（哲学者 AND テーマ）
-        if philosophers and themes:
-            candidates = [
-                ep for ep in EPISODES
-                if (any(p in ep.philosophers for p in philosophers)
-                    and any(t in ep.themes for t in themes))
-            ]
-            
-            # 5個未満ならフォールバック
-            if len(candidates) < 5:
-                fallback_level = 1
-                # Level 1: 片方マッチ（哲学者 OR テーマ）
-                candidates = [
-                    ep for ep in EPISODES
-                    if (any(p in ep.philosophers for p in philosophers)
-                        or any(t in ep.themes for t in themes))
-                ]
-        
-        # Level 1.5: 哲学者またはテーマのいずれかのみ指定
-        elif philosophers or themes:
-            candidates = [
-                ep for ep in EPISODES
-                if (any(p in ep.philosophers for p in philosophers)
-                    or any(t in ep.themes for t in themes))
-            ]
-            
-            # 5個未満ならフォールバック
-            if len(candidates) < 5:
-                fallback_level = 2
-        
-        # Level 2: キーワード検索（サブテーマ）
-        if len(candidates) < 5 and search_query:
-            fallback_level = 2
-            search_lower = search_query.lower()
-            candidates = [
-                ep for ep in EPISODES
-                if (search_lower in ep.title.lower()
-                    or search_lower in ep.summary.lower())
-            ]
-        
-        # Level 3: すべてのエピソード（新しい順）
-        if len(candidates) < 5:
-            fallback_level = 3
-            candidates = EPISODES
-        
-        # ========== フォールバックロジック終了 ==========
-        
-        # ステップ2: スコア計算
-        scores = np.zeros(len(candidates))
-        
-        if search_query and candidates:
-            # Embedding モデルをロード
-            from sentence_transformers import SentenceTransformer
-            model = SentenceTransformer(
-                "sentence-transformers/paraphrase-multilingual-minilm-l12-v2"
-            )
-            
-            user_embedding = model.encode(search_query, convert_to_numpy=True)
-            
-            for i, ep in enumerate(candidates):
-                if ep.embedding is not None:
-                    sim = cosine_similarity(
-                        user_embedding.reshape(1, -1),
-                        ep.embedding.reshape(1, -1)
-                    )[0, 0]
-                    scores[i] = float(sim)
-        else:
-            # タグのみの場合は「新しい順」（後ろのエピソード優先）
-            scores = np.arange(len(candidates), 0, -1, dtype=float)
-        
-        # ステップ3: ソートして TOP K を取得（常に5個）
-        if len(candidates) > 0:
-            sorted_indices = np.argsort(scores)[::-1][:top_k]
-            results = [
-                {
-                    "notion_id": candidates[i].notion_id,
-                    "title": candidates[i].title,
-                    "url": candidates[i].url,
-                    "summary": candidates[i].summary,
-                    "episode_type": candidates[i].episode_type,
-                    "difficulty": candidates[i].difficulty,
-                }
-                for i in sorted_indices
-            ]
-        else:
-            results = []
-        
-        # フォールバック時のメッセージ
-        messages = {
-            0: None,  # 厳密なマッチ、通知なし
-            1: "⚠️ マッチ数が少ないため、関連エピソードも含めて表示しています",
-            2: "⚠️ マッチ数が少ないため、キーワード検索の結果を表示しています",
-            3: "⚠️ マッチ数が少ないため、最新のエピソードを表示しています"
-        }
+        # クエリを正規化（順序・重複を無視してキャッシュキーにする）
+        core = _discover_core(
+            tuple(sorted({p for p in philosophers if isinstance(p, str)})),
+            tuple(sorted({t for t in themes if isinstance(t, str)})),
+            search_query,
+        )
+        results = core["results"]
+        fallback_level = core["fallback_level"]
         
         log.info(f"✅ {len(results)} 件のエピソードを返却（fallback_level={fallback_level}）")
         
         return jsonify({
             "results": results,
             "fallback_level": fallback_level,
-            "message": messages.get(fallback_level),
+            "message": FALLBACK_MESSAGES.get(fallback_level),
             "query": {
                 "philosophers": philosophers,
                 "themes": themes,
@@ -0,0 +1,205 @@
+"""
+episode_csv.py
+────────────────────────────────────────────────────────────────────────────────
+エピソード CSV / Arrow の読み込み（app_lightweight と prebuild.py で共用）
+
+  • import しても何も起動しない（Flask アプリ・読み込みスレッド・JIT コンパイルなし）
+  • pyarrow があれば列単位（ネイティブ実装）で読み込み、無ければ csv.DictReader
+  • prebuild.py が書き出した Arrow ファイルが CSV より新しければ mmap で読み込む
+"""
+
+import csv
+import os
+import logging
+import time
+from typing import List, Dict
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pv
+    import pyarrow.compute as pc
+except ImportError:  # pyarrow が無い環境では csv モジュールで読み込む
+    pa = None
+
+log = logging.getLogger(__name__)
+
+# 読み込みループで何行ごとに GIL を手放すか（起動中も他スレッドが応答できるように）
+YIELD_EVERY_ROWS = 1000
+
+RELEVANCE_SCORES = {"高": 3, "中": 2, "低": 1}
+DIFFICULTY_SCORES = {"入門": 1, "中級": 2, "上級": 3}
+
+CSV_PATH = "soretetsudb_260223.csv"
+# prebuild.py が CSV から生成する Arrow IPC ファイル（あれば CSV より優先）
+ARROW_PATH = "episodes.arrow"
+
+# 使用する列と、列が無い場合の既定値（csv.DictReader 版の row.get() と同じ）
+CSV_COLUMN_DEFAULTS = {
+    "Name": "", "Summary": "", "URL": "", "エピソード種別": "",
+    "テーマ": "", "ルディクレア関連度": "中", "哲学者": "", "難易度": "中級",
+}
+
+def load_episodes_from_csv(
+    csv_path: str = CSV_PATH, arrow_path: str = ARROW_PATH
+) -> List[Dict]:
+    """
+    CSV ファイルからエピソードを読み込む
+    
+    重要: 
+      - Nameフィールドを "name" として保持
+      - 難易度を数値化（スコアリングの補助因子として機能）
+      - pyarrow があれば列単位（ネイティブ実装）で分割・整形する
+      - CSV より新しい Arrow ファイルがあれば mmap で読み込む（パース不要）
+    """
+    episodes = []
+    
+    try:
+        if pa is not None and _arrow_is_fresh(arrow_path, csv_path):
+            with pa.memory_map(arrow_path) as source:
+                tbl = pa.ipc.open_file(source).read_all()
+            episodes = _episodes_from_table(tbl)
+            log.info(f"✅ Arrow から {len(episodes)} 件のエピソードを読み込み")
+            return episodes
+        
+        if not os.path.exists(csv_path):
+            log.warning(f"CSV ファイルが見つかりません: {csv_path}")
+            return episodes
+        
+        if pa is not None:
+            episodes = _episodes_from_table(read_episode_table(csv_path))
+        else:
+            episodes = _read_episodes_dictreader(csv_path)
+        
+        log.info(f"✅ CSV から {len(episodes)} 件のエピソードを読み込み")
+    
+    except Exception as e:
+        log.error(f"CSV 読み込みエラー: {e}")
+    
+    return episodes
+
+def _arrow_is_fresh(arrow_path: str, csv_path: str) -> bool:
+    """Arrow ファイルが存在し、元の CSV より古くないか"""
+    if not os.path.exists(arrow_path):
+        return False
+    if not os.path.exists(csv_path):
+        return True
+    return os.path.getmtime(arrow_path) >= os.path.getmtime(csv_path)
+
+def read_episode_table(csv_path: str = CSV_PATH) -> "pa.Table":
+    """CSV を文字列列のテーブルとして読み込む（欠損列・null は既定値で埋める）"""
+    tbl = pv.read_csv(
+        csv_path,
+        parse_options=pv.ParseOptions(newlines_in_values=True),
+        convert_options=pv.ConvertOptions(
+            column_types={c: pa.string() for c in CSV_COLUMN_DEFAULTS},
+            include_columns=list(CSV_COLUMN_DEFAULTS),
+            include_missing_columns=True,
+        ),
+    )
+    return pa.table({
+        c: pc.fill_null(tbl.column(c).combine_chunks(), default)
+        for c, default in CSV_COLUMN_DEFAULTS.items()
+    })
+
+def _episodes_from_table(tbl: "pa.Table") -> List[Dict]:
+    """列ごとに分割・trim・数値化をまとめて行い、エピソード dict を作る"""
+    cols = {c: tbl.column(c).combine_chunks() for c in CSV_COLUMN_DEFAULTS}
+
+    def split_tags(col) -> List[List[str]]:
+        # 「, 」区切りを分割し、要素ごとの trim をまとめて実行
+        parts = pc.split_pattern(col, ",")
+        trimmed = pc.utf8_trim_whitespace(parts.flatten())
+        parts = pa.ListArray.from_arrays(parts.offsets, trimmed)
+        return [[v for v in tags if v] for tags in parts.to_pylist()]
+
+    def encode_scores(col, table: Dict[str, int], default: int):
+        # 種類の少ない文字列は辞書エンコードして小さな参照表で数値化
+        encoded = pc.dictionary_encode(col)
+        lookup = np.array(
+            [table.get(v, default) for v in encoded.dictionary.to_pylist()],
+            dtype=np.int64,
+        )
+        return lookup[encoded.indices.to_numpy(zero_copy_only=False)].tolist()
+
+    relevance = pc.utf8_trim_whitespace(cols["ルディクレア関連度"])
+    difficulty = pc.utf8_trim_whitespace(cols["難易度"])
+
+    names = cols["Name"].to_pylist()
+    rows = zip(
+        names,
+        cols["URL"].to_pylist(),
+        cols["Summary"].to_pylist(),
+        cols["エピソード種別"].to_pylist(),
+        difficulty.to_pylist(),
+        encode_scores(difficulty, DIFFICULTY_SCORES, 2),
+        split_tags(cols["哲学者"]),
+        split_tags(cols["テーマ"]),
+        encode_scores(relevance, RELEVANCE_SCORES, 1),
+    )
+
+    return [
+        {
+            "notion_id": f"csv_{idx}",
+            "name": name,  # ★ Nameフィールド確実保持
+            "title": name,
+            "url": url,
+            "summary": summary,
+            "episode_type": episode_type,
+            "difficulty": diff,
+            "difficulty_score": diff_score,
+            "philosophers": philosophers,
+            "themes": themes,
+            "relevance_score": relevance_score,
+        }
+        for idx, (name, url, summary, episode_type, diff, diff_score,
+                  philosophers, themes, relevance_score) in enumerate(rows)
+    ]
+
+def _read_episodes_dictreader(csv_path: str) -> List[Dict]:
+    """csv.DictReader で1行ずつ読み込む（pyarrow が無い場合）"""
+    episodes = []
+    
+    with open(csv_path, "r", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        
+        for idx, row in enumerate(reader):
+            if idx % YIELD_EVERY_ROWS == 0:
+                time.sleep(0)
+            
+            # 哲学者とテーマをリスト化
+            philosophers = [
+                p.strip() for p in row.get("哲学者", "").split(",") 
+                if p.strip()
+            ]
+            themes = [
+                t.strip() for t in row.get("テーマ", "").split(",") 
+                if t.strip()
+            ]
+            
+            # ルディクレア関連度を数値化
+            relevance = row.get("ルディクレア関連度", "中").strip()
+            relevance_score = RELEVANCE_SCORES.get(relevance, 1)
+            
+            # 難易度を数値化
+            difficulty = row.get("難易度", "中級").strip()
+            difficulty_score = DIFFICULTY_SCORES.get(difficulty, 2)
+            
+            episode = {
+                "notion_id": f"csv_{idx}",
+                "name": row.get("Name", ""),  # ★ Nameフィールド確実保持
+                "title": row.get("Name", ""),  # これは既存
+                "url": row.get("URL", ""),
+                "summary": row.get("Summary", ""),
+                "episode_type": row.get("エピソード種別", ""),
+                "difficulty": difficulty,
+                "difficulty_score": difficulty_score,
+                "philosophers": philosophers,
+                "themes": themes,
+                "relevance_score": relevance_score,
+            }
+            
+            episodes.append(episode)
+    
+    return episodes
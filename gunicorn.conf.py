@@ -0,0 +1,17 @@
+"""
+gunicorn.conf.py
+────────────────────────────────────────────────────────────────────────────────
+本番起動設定（このディレクトリから起動した gunicorn が、アプリに関係なく自動的に読み込む。
+gunicorn app_v2:app だけでなく gunicorn app_lightweight:app にも適用される）
+
+  • gevent ワーカー: モデル読み込み・I/O 待ちで他のリクエストを止めない
+  • app_v2 の初回キャッシュ構築と Embedding 計算（CPU）は OS スレッドに逃がす
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+worker_class = "gevent"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+worker_connections = 1000
+timeout = 120
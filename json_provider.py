@@ -0,0 +1,47 @@
+"""
+json_provider.py
+────────────────────────────────────────────────────────────────────────────────
+Flask 用 JSON プロバイダ（orjson 版）
+
+  • jsonify / request.json / app.json.dumps がすべて orjson 経由になる
+  • orjson はバイト列を直接書き出すため、標準 json より速くメモリ確保も少ない
+  • orjson が無い環境では Flask 標準のプロバイダをそのまま使う
+
+使い方:
+    app.json = JSONProvider(app)
+"""
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson は任意依存
+    orjson = None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """orjson で読み書きする JSON プロバイダ"""
+
+    def _option(self, indent: bool = False) -> int:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj, **kwargs) -> str:
+        option = self._option(indent=bool(kwargs.get("indent")))
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        data = orjson.dumps(obj, default=self.default, option=self._option(indent))
+        return self._app.response_class(data, mimetype=self.mimetype)
+
+
+JSONProvider = OrjsonProvider if orjson is not None else DefaultJSONProvider
@@ -0,0 +1,34 @@
+"""
+prebuild.py
+────────────────────────────────────────────────────────────────────────────────
+デプロイ（ビルド）時に1回だけ実行：CSV → Arrow IPC（Feather）変換
+
+  python prebuild.py
+
+起動時は episodes.arrow を mmap するだけになり、CSV のパースが不要になる
+（CSV の方が新しい場合は episode_csv.py が自動的に CSV を読み直す）
+"""
+
+import logging
+import os
+
+import pyarrow.feather as feather
+
+from episode_csv import CSV_PATH, ARROW_PATH, read_episode_table
+
+log = logging.getLogger(__name__)
+
+
+def main():
+    tbl = read_episode_table(CSV_PATH)
+    # 非圧縮で書き出す（mmap したページをそのまま読めるように）
+    # 書きかけのファイルを読まれないよう、一時ファイルから置き換える
+    tmp_path = f"{ARROW_PATH}.tmp"
+    feather.write_feather(tbl, tmp_path, compression="uncompressed")
+    os.replace(tmp_path, ARROW_PATH)
+    log.info(f"✅ {CSV_PATH} → {ARROW_PATH}（{tbl.num_rows} 件）")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
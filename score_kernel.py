@@ -0,0 +1,64 @@
+"""
+score_kernel.py
+────────────────────────────────────────────────────────────────────────────────
+Discovery UI スコアリングカーネル
+
+  • 数値配列だけを受け取る純粋な関数（Numba のディスクキャッシュ対象）
+  • クエリは「選ばれた列の添字＋重み」で受け取り、その列だけを走査する
+    （選択肢は最大でも数列なので、全列の行列積より大幅に少ない）
+  • numba があれば JIT コンパイル（ループは LLVM が SIMD 化）
+  • numba が無い環境では同じ計算を NumPy の行列積で行う
+"""
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:  # numba は任意依存
+    numba = None
+
+
+def _score_kernel_numpy(
+    phil_mask, theme_mask, name_has_phil, zatsudan, relev, diff,
+    phil_cols, phil_w, theme_cols, theme_w,
+):
+    """NumPy 版: クエリで選ばれた列だけを取り出して行列積"""
+    return (
+        (phil_mask[:, phil_cols] + name_has_phil[:, phil_cols]) @ phil_w * 100
+        + theme_mask[:, theme_cols] @ theme_w * 30
+        + relev
+        + diff
+        - zatsudan * 200
+    )
+
+
+if numba is not None:
+
+    # parallel=True は使わない: Flask の複数スレッドやバックグラウンド読み込み
+    # スレッドから呼ぶとスレッドプール（TBB 等）の停止時にプロセスが終了しなくなる。
+    # 数百件規模ではスレッド起動コストの方が大きい
+    @numba.njit(cache=True)
+    def _score_kernel_numba(
+        phil_mask, theme_mask, name_has_phil, zatsudan, relev, diff,
+        phil_cols, phil_w, theme_cols, theme_w,
+    ):
+        """Numba 版: エピソード（行）ごとに、クエリで選ばれた列だけを加算"""
+        n = phil_mask.shape[0]
+        scores = np.empty(n, dtype=np.int64)
+
+        for i in range(n):
+            s = np.int64(relev[i]) + diff[i]
+            for k in range(len(phil_cols)):
+                j = phil_cols[k]
+                s += phil_w[k] * (100 * phil_mask[i, j] + 100 * name_has_phil[i, j])
+            for k in range(len(theme_cols)):
+                s += theme_w[k] * 30 * theme_mask[i, theme_cols[k]]
+            if zatsudan[i]:
+                s -= 200
+            scores[i] = s
+
+        return scores
+
+    score_kernel = _score_kernel_numba
+else:
+    score_kernel = _score_kernel_numpy
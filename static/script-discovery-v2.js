@@ -16,6 +16,8 @@
 const API_BASE = "";
 const API_CONFIG = `${API_BASE}/api/config`;
 const API_DISCOVER = `${API_BASE}/api/discover`;
+// サーバーがデータ読み込み中（503）の間、Retry-After に従って再試行する回数
+const DISCOVER_MAX_RETRIES = 10;
 
 // YouTube サムネイル URL テンプレート
 const YOUTUBE_THUMBNAIL = (videoId) => 
@@ -128,11 +130,22 @@ async function discover(philosophers = [], themes = [], subtheme = "") {
             console.warn("GA トラッキングエラー（無視）:", e);
         }
 
-        const res = await fetch(API_DISCOVER, {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify(payload),
-        });
+        let res;
+        for (let attempt = 0; ; attempt++) {
+            res = await fetch(API_DISCOVER, {
+                method: "POST",
+                headers: { "Content-Type": "application/json" },
+                body: JSON.stringify(payload),
+            });
+            if (res.status !== 503 || attempt >= DISCOVER_MAX_RETRIES) {
+                break;
+            }
+
+            // 起動直後のデータ読み込み中: Retry-After 秒（無ければ2秒）待って再試行
+            const retryAfter = parseFloat(res.headers.get("Retry-After")) || 2;
+            log(`⏳ データ読み込み中のため ${retryAfter} 秒後に再試行`);
+            await new Promise((resolve) => setTimeout(resolve, retryAfter * 1000));
+        }
 
         if (!res.ok) {
             const errorData = await res.json();
@@ -0,0 +1,129 @@
+"""
+onnx_encoder.py
+────────────────────────────────────────────────────────────────────────────────
+ONNX Runtime（int8 動的量子化）版の Embedding エンコーダ
+
+  • SentenceTransformer.encode と同じ呼び出し方で使える薄いラッパー
+  • トークナイズ → ONNX 推論 → 平均プーリング →（指定時）L2 正規化
+  • onnxruntime / transformers が無い環境、または書き出し済みモデルが無い場合は使わない
+    （recommend_engine は SentenceTransformer にフォールバック）
+
+【書き出し（オフラインで1回）】
+  pip install "optimum[onnxruntime]"
+  python onnx_encoder.py
+"""
+
+import os
+import logging
+from typing import List, Union
+
+import numpy as np
+
+try:
+    import onnxruntime as ort
+    from transformers import AutoTokenizer
+except ImportError:  # onnxruntime / transformers は任意依存
+    ort = None
+
+log = logging.getLogger(__name__)
+
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "miniLM_onnx")
+ONNX_MODEL_FILE = "model_int8.onnx"
+MAX_SEQ_LENGTH = 128  # paraphrase-multilingual-MiniLM-L12-v2 の max_seq_length
+
+
+class OnnxEncoder:
+    """量子化済み ONNX モデルで文を Embedding に変換"""
+
+    def __init__(self, model_dir: str = ONNX_MODEL_DIR):
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, ONNX_MODEL_FILE),
+            options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    @staticmethod
+    def available(model_dir: str = ONNX_MODEL_DIR) -> bool:
+        """onnxruntime が使え、書き出し済みモデルがあるか"""
+        return ort is not None and os.path.exists(os.path.join(model_dir, ONNX_MODEL_FILE))
+
+    def encode(
+        self,
+        sentences: Union[str, List[str]],
+        batch_size: int = 32,
+        convert_to_numpy: bool = True,
+        normalize_embeddings: bool = False,
+        show_progress_bar: bool = False,
+    ) -> np.ndarray:
+        """SentenceTransformer.encode 互換（戻り値は常に NumPy 配列）"""
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+
+        # 長い順に並べ、バッチごとのパディングを最小にする（SentenceTransformer と同じ）
+        order = np.argsort([-len(s) for s in sentences], kind="stable")
+        batches = []
+        for start in range(0, len(sentences), batch_size):
+            batch = [sentences[i] for i in order[start:start + batch_size]]
+            batches.append(self._encode_batch(batch))
+
+        if batches:
+            stacked = np.concatenate(batches)
+            embeddings = np.empty_like(stacked)
+            embeddings[order] = stacked  # 元の並びに戻す
+        else:
+            embeddings = np.zeros((0, 0), dtype=np.float32)
+
+        if normalize_embeddings:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.maximum(norms, 1e-12)
+
+        return embeddings[0] if single else embeddings
+
+    def _encode_batch(self, batch: List[str]) -> np.ndarray:
+        """1バッチ分を推論し、attention mask 付きの平均プーリングをかける"""
+        tokens = self.tokenizer(
+            batch,
+            padding=True,
+            truncation=True,
+            max_length=MAX_SEQ_LENGTH,
+            return_tensors="np",
+        )
+        inputs = {
+            name: tokens[name].astype(np.int64)
+            for name in ("input_ids", "attention_mask", "token_type_ids")
+            if name in self.input_names and name in tokens
+        }
+        hidden = self.session.run(None, inputs)[0]  # (B, L, D)
+
+        mask = tokens["attention_mask"][..., None].astype(np.float32)
+        summed = (hidden * mask).sum(axis=1)
+        return (summed / np.maximum(mask.sum(axis=1), 1e-9)).astype(np.float32)
+
+
+def export_onnx_model(model_name: str, model_dir: str = ONNX_MODEL_DIR):
+    """Hugging Face のモデルを ONNX に書き出し、重みを int8 に動的量子化する"""
+    from optimum.onnxruntime import ORTModelForFeatureExtraction
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    log.info(f"📦 ONNX 書き出し中: {model_name} → {model_dir}")
+    ORTModelForFeatureExtraction.from_pretrained(model_name, export=True).save_pretrained(model_dir)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(model_dir)
+
+    quantize_dynamic(
+        os.path.join(model_dir, "model.onnx"),
+        os.path.join(model_dir, ONNX_MODEL_FILE),
+        weight_type=QuantType.QInt8,
+    )
+    log.info(f"✅ int8 量子化完了: {os.path.join(model_dir, ONNX_MODEL_FILE)}")
+
+
+if __name__ == "__main__":
+    from recommend_engine import EMBEDDING_MODEL_NAME
+
+    export_onnx_model(EMBEDDING_MODEL_NAME)
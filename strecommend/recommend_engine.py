@@ -10,7 +10,9 @@ recommend_engine.py
 4. タグマッチング（哲学者・テーマ）でブースト調整
 
 【セットアップ】
-  pip install sentence-transformers requests python-dotenv numpy scikit-learn
+  pip install sentence-transformers requests python-dotenv numpy
+  （任意）python onnx_encoder.py で int8 量子化した ONNX モデルを書き出すと、
+          以後の Embedding 生成は ONNX Runtime で行う
 """
 
 import os
@@ -18,15 +20,28 @@ import json
 import sqlite3
 import logging
 import time
+import functools
+import bisect
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, List, Dict, Tuple
 from dataclasses import dataclass
 from pathlib import Path
 
 import requests
+from requests.adapters import HTTPAdapter
 import numpy as np
 from dotenv import load_dotenv
 from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
+
+try:
+    import torch
+except ImportError:  # ONNX Runtime のみで動かす場合
+    torch = None
+
+from onnx_encoder import OnnxEncoder
+from recommend_kernel import score_and_topk, top_k_indices
 
 load_dotenv()
 
@@ -49,10 +64,31 @@ NOTION_HEADERS = {
 }
 SORETETSU_DATABASE_ID = os.getenv("SORETETSU_DATABASE_ID", "30def4a3aa6b80c0a9afd3059538c7f2")
 EMBEDDING_DB_PATH = "episode_embeddings.db"
-RATE_LIMIT_SLEEP = 0.4
+# 全エピソードの正規化済み Embedding 行列（mmap で読む。行番号は SQLite の embedding_rows）
+EMBEDDING_MATRIX_PATH = "episode_embeddings.npy"
+RATE_LIMIT_SLEEP = 0.4     # レート制限が近い・Retry-After が無いときの待ち時間
+NOTION_MAX_RETRIES = 3     # 429 のときの再試行回数
+NOTION_REQUESTS_PER_SECOND = 3  # Notion のレート制限（平均 約3リクエスト/秒）
+# 本文取得の並列数（1リクエスト 300ms 前後なので、上の間隔で送るにはこれで足りる）
+BLOCK_FETCH_WORKERS = NOTION_REQUESTS_PER_SECOND
+
+# Notion API への接続は使い回す（TCP/TLS ハンドシェイクを毎回しない）
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=16))
+# 全スレッド共通の送信間隔（次のリクエストを送ってよい時刻）
+_RATE_LOCK = threading.Lock()
+_next_request_at = 0.0
 
 # 日本語対応の軽量Embeddingモデル
 EMBEDDING_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-minilm-l12-v2"
+# PyTorch の推論スレッド数（コンテナでは既定が1になることがあるので明示する）
+TORCH_NUM_THREADS = int(os.getenv("TORCH_NUM_THREADS", os.cpu_count() or 4))
+# EMBEDDING_MODEL_NAME の次元数。meta テーブルが無い DB（BLOB の型が記録されていない）では、
+# バイト数がこの次元数の float32 分か float16 分かで型を判別する
+EMBEDDING_MODEL_DIM = 384
+# SQLite に保存する Embedding の型（正規化済みなので float16 で精度は十分）
+EMBEDDING_DTYPE = np.float16
+TAG_SEPARATOR = "\x1f"  # タグ一覧の区切り文字（ASCII Unit Separator）
 
 
 @dataclass
@@ -84,10 +120,59 @@ class Episode:
         }
 
 
+# ─── PyTorch 推論設定 ─────────────────────────────────────────
+# 推論専用なので autograd は使わない（encode 呼び出しは inference_mode で囲む。
+# grad モードはスレッドごとの設定なので、ワーカースレッドでもこちらが効く）
+if torch is not None:
+    torch.set_num_threads(TORCH_NUM_THREADS)
+    torch.set_grad_enabled(False)
+    inference_mode = torch.inference_mode
+else:
+    inference_mode = contextlib.nullcontext
+
+
 # ════════════════════════════════════════════════════════════════════════════
 # Notion API ユーティリティ
 # ════════════════════════════════════════════════════════════════════════════
 
+def _wait_for_rate_slot():
+    """前のリクエストから 1/NOTION_REQUESTS_PER_SECOND 秒空くまで待つ（スレッド間で共有）"""
+    global _next_request_at
+    with _RATE_LOCK:
+        now = time.monotonic()
+        slot = max(now, _next_request_at)
+        _next_request_at = slot + 1 / NOTION_REQUESTS_PER_SECOND
+    # 待つのはロックの外（他スレッドは自分の枠を予約して並んで待つ）
+    if slot > now:
+        time.sleep(slot - now)
+
+
+def _notion_request(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Notion API 呼び出し（NOTION_REQUESTS_PER_SECOND 以下の間隔で送る）
+
+      - 429: Retry-After（無ければ指数バックオフ）だけ待って再試行
+      - X-Ratelimit-Remaining が残りわずか: 次の呼び出しの前に少し待つ
+    """
+    for attempt in range(NOTION_MAX_RETRIES + 1):
+        _wait_for_rate_slot()
+        resp = SESSION.request(method, url, headers=NOTION_HEADERS, **kwargs)
+
+        if resp.status_code == 429 and attempt < NOTION_MAX_RETRIES:
+            try:
+                wait = float(resp.headers.get("Retry-After", ""))
+            except ValueError:
+                wait = RATE_LIMIT_SLEEP * 2 ** attempt
+            log.warning(f"⏳ Notion レート制限: {wait:.1f} 秒待って再試行")
+            time.sleep(wait)
+            continue
+
+        remaining = resp.headers.get("X-Ratelimit-Remaining", "")
+        if remaining.isdigit() and int(remaining) <= 1:
+            time.sleep(RATE_LIMIT_SLEEP)
+        return resp
+
+
 def fetch_all_episodes() -> List[Episode]:
     """Notionから全エピソードを読み込む"""
     episodes = []
@@ -99,9 +184,9 @@ def fetch_all_episodes() -> List[Episode]:
         if cursor:
             body["start_cursor"] = cursor
 
-        resp = requests.post(
+        resp = _notion_request(
+            "POST",
             f"https://api.notion.com/v1/databases/{SORETETSU_DATABASE_ID}/query",
-            headers=NOTION_HEADERS,
             json=body,
         )
 
@@ -123,14 +208,20 @@ def fetch_all_episodes() -> List[Episode]:
             break
 
         cursor = data.get("next_cursor")
-        time.sleep(RATE_LIMIT_SLEEP)
+
+    # Full Log（本文）はページ一覧を読み終えてから並列に取得
+    log.info(f"📄 本文取得中... {len(episodes)} 件")
+    with ThreadPoolExecutor(max_workers=BLOCK_FETCH_WORKERS) as pool:
+        full_logs = pool.map(_fetch_page_blocks_text, [ep.notion_id for ep in episodes])
+        for ep, full_log in zip(episodes, full_logs):
+            ep.full_log = full_log
 
     log.info(f"✅ Notion読み込み完了: {len(episodes)} 件")
     return episodes
 
 
 def _parse_page(page: dict) -> Optional[Episode]:
-    """Notionページからエピソードデータを抽出"""
+    """Notionページからエピソードデータを抽出（Full Log は fetch_all_episodes で後から埋める）"""
     try:
         props = page.get("properties", {})
 
@@ -149,9 +240,6 @@ def _parse_page(page: dict) -> Optional[Episode]:
             for t in props.get("Summary", {}).get("rich_text", [])
         )
 
-        # Full Log（本文）
-        full_log = _fetch_page_blocks_text(page["id"])
-
         # タグ情報
         philosophers = [
             opt["name"]
@@ -173,7 +261,7 @@ def _parse_page(page: dict) -> Optional[Episode]:
             title=title,
             url=url,
             summary=summary,
-            full_log=full_log,
+            full_log="",
             philosophers=philosophers,
             themes=themes,
             episode_type=episode_type,
@@ -188,9 +276,9 @@ def _parse_page(page: dict) -> Optional[Episode]:
 def _fetch_page_blocks_text(page_id: str) -> str:
     """Notionページの本文をすべて取得"""
     try:
-        resp = requests.get(
+        resp = _notion_request(
+            "GET",
             f"https://api.notion.com/v1/blocks/{page_id}/children?page_size=100",
-            headers=NOTION_HEADERS,
             timeout=30,
         )
         if resp.status_code != 200:
@@ -213,17 +301,86 @@ def _fetch_page_blocks_text(page_id: str) -> str:
 # Embedding ユーティリティ
 # ════════════════════════════════════════════════════════════════════════════
 
+def stack_embeddings(
+    embeddings: List[Optional[np.ndarray]], dim: Optional[int] = None
+) -> np.ndarray:
+    """
+    Embedding の一覧を行ごとに単位ベクトル化した float32 の連続行列にまとめる
+
+    保存済みの Embedding は正規化済みだが、古いキャッシュに備えてここでも正規化する。
+    None の行は0ベクトル（類似度 0）になる。
+    次元数を省略した場合は Embedding から決める（モデルの次元数に依存しない）
+    """
+    if dim is None:
+        dim = next((len(e) for e in embeddings if e is not None), 0)
+    matrix = np.zeros((len(embeddings), dim), dtype=np.float32)
+    for i, embedding in enumerate(embeddings):
+        if embedding is not None:
+            matrix[i] = embedding
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.maximum(norms, 1e-12)
+    return matrix
+
+
+def build_tag_mask(tag_lists: List[List[str]]) -> Tuple[Dict[str, int], np.ndarray]:
+    """エピソードごとのタグ一覧から (タグ → 列番号, (N, タグ数) の bool 行列) を作る"""
+    vocab = {tag: j for j, tag in enumerate(sorted({t for tags in tag_lists for t in tags}))}
+    mask = np.zeros((len(tag_lists), len(vocab)), dtype=bool)
+    for i, tags in enumerate(tag_lists):
+        mask[i, [vocab[tag] for tag in tags]] = True
+    return vocab, mask
+
+
+def encode_tags(tags: List[str]) -> str:
+    """タグ一覧を SQLite 保存用の文字列にする（区切り文字 U+001F で連結）"""
+    return TAG_SEPARATOR.join(tags)
+
+
+def decode_tags(value: Optional[str]) -> List[str]:
+    """encode_tags の逆変換（以前の JSON 形式の行も読める）"""
+    if not value:
+        return []
+    if value.startswith("["):
+        return json.loads(value)
+    return value.split(TAG_SEPARATOR)
+
+
+def decode_embedding(embedding_bytes: bytes, dim: int, dtype: np.dtype) -> np.ndarray:
+    """
+    SQLite の BLOB から Embedding を復元する（dim・dtype は EmbeddingCache.load_meta の値）
+
+    以前は float32 で保存していたため、バイト数が float32 の dim 次元分の行は float32 として読む
+    """
+    if len(embedding_bytes) == dim * np.dtype(np.float32).itemsize:
+        return np.frombuffer(embedding_bytes, dtype=np.float32)
+    return np.frombuffer(embedding_bytes, dtype=dtype)
+
+
 class EmbeddingCache:
     """エピソードのEmbeddingをSQLiteで管理"""
 
-    def __init__(self, db_path: str = EMBEDDING_DB_PATH):
+    def __init__(
+        self,
+        db_path: str = EMBEDDING_DB_PATH,
+        matrix_path: str = EMBEDDING_MATRIX_PATH,
+    ):
         self.db_path = db_path
-        self.model = None
+        self.matrix_path = matrix_path
         self._init_db()
 
+    def _connect(self) -> sqlite3.Connection:
+        """接続ごとの PRAGMA を設定した SQLite 接続を返す"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("PRAGMA synchronous=NORMAL")   # WAL では NORMAL で十分安全
+        conn.execute("PRAGMA mmap_size=268435456")  # 256MB まで mmap で読む
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
     def _init_db(self):
         """テーブルを作成（なければ）"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")  # DB ファイルに保存される設定
         conn.execute("""
             CREATE TABLE IF NOT EXISTS episodes (
                 notion_id TEXT PRIMARY KEY,
@@ -240,86 +397,202 @@ class EmbeddingCache:
                 embedding_updated_at TIMESTAMP
             )
         """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS embedding_rows (
+                notion_id TEXT PRIMARY KEY,
+                row INTEGER NOT NULL
+            )
+        """)
         conn.commit()
         conn.close()
 
+    @property
+    def model(self):
+        """Embedding モデル（プロセス内で共有し、初回参照時に読み込む）"""
+        return _get_model()
+
+    def load_meta(self, conn: sqlite3.Connection) -> Tuple[int, np.dtype]:
+        """
+        保存済み Embedding の (次元数, 型) を meta テーブルから読む
+
+        meta が無い（以前のバージョンで作った）DB では次元数は EMBEDDING_MODEL_DIM とし、
+        float32・float16 のどちらで保存したかは decode_embedding がバイト数で判別する
+        """
+        meta = dict(conn.execute("SELECT key, value FROM meta"))
+        dim = int(meta.get("dim", EMBEDDING_MODEL_DIM))
+        dtype = np.dtype(meta.get("dtype", np.dtype(EMBEDDING_DTYPE).name))
+        return dim, dtype
+
     def load_model(self):
         """Embedding モデルをロード（初回のみ遅い）"""
-        if self.model is None:
+        if _MODEL is None:
             log.info(f"🤖 モデル読み込み中: {EMBEDDING_MODEL_NAME}")
-            self.model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+            _get_model()
             log.info("✅ モデル読み込み完了")
 
     def generate_and_cache_embeddings(self, episodes: List[Episode]):
         """全エピソードのEmbeddingを生成してキャッシュ"""
-        self.load_model()
-
-        log.info(f"📊 {len(episodes)} 件のEmbedding生成中...")
-
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
 
-        for idx, ep in enumerate(episodes):
-            # キャッシュ確認
-            cursor.execute("SELECT embedding FROM episodes WHERE notion_id = ?", (ep.notion_id,))
-            cached = cursor.fetchone()
+        # キャッシュ確認（Embedding 済みの ID を一度に取得）
+        cursor.execute("SELECT notion_id FROM episodes WHERE embedding IS NOT NULL")
+        cached_ids = {row[0] for row in cursor.fetchall()}
+        pending = [ep for ep in episodes if ep.notion_id not in cached_ids]
 
-            if cached and cached[0] is not None:
-                log.debug(f"   [{idx+1}/{len(episodes)}] {ep.title[:50]} (キャッシュあり)")
-                continue
-
-            # テキスト結合：Summary + Full Log（最初2000字）
-            text = f"{ep.summary}\n\n{ep.full_log[:2000]}"
+        log.info(
+            f"📊 {len(pending)} 件のEmbedding生成中..."
+            f"（キャッシュあり {len(episodes) - len(pending)} 件）"
+        )
 
-            # Embedding生成
-            embedding = self.model.encode(text, convert_to_numpy=True)
-            embedding_bytes = embedding.tobytes()
+        if pending:
+            self.load_model()
 
-            # DB保存
-            cursor.execute("""
+            # テキスト結合：Summary + Full Log（最初2000字）
+            texts = [f"{ep.summary}\n\n{ep.full_log[:2000]}" for ep in pending]
+
+            # Embedding生成（まとめて encode し、長さの近い文どうしでバッチ化させる）
+            with inference_mode():
+                embeddings = self.model.encode(
+                    texts,
+                    batch_size=32,
+                    convert_to_numpy=True,
+                    normalize_embeddings=True,
+                    show_progress_bar=True,
+                )
+
+            # DB保存（1トランザクションでまとめて書き込む）
+            cursor.execute("BEGIN")
+            cursor.executemany("""
                 INSERT OR REPLACE INTO episodes
                 (notion_id, title, url, summary, full_log, philosophers, themes,
                  episode_type, difficulty, ludicrea_relevance, embedding, embedding_updated_at)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, datetime('now'))
-            """, (
-                ep.notion_id,
-                ep.title,
-                ep.url,
-                ep.summary,
-                ep.full_log[:2000],
-                json.dumps(ep.philosophers),
-                json.dumps(ep.themes),
-                ep.episode_type,
-                ep.difficulty,
-                ep.ludicrea_relevance,
-                embedding_bytes,
-            ))
-
-            if (idx + 1) % 50 == 0:
-                conn.commit()
-                log.info(f"   [{idx+1}/{len(episodes)}] {len(embedding)}次元 Embedding")
+            """, [
+                (
+                    ep.notion_id,
+                    ep.title,
+                    ep.url,
+                    ep.summary,
+                    ep.full_log[:2000],
+                    encode_tags(ep.philosophers),
+                    encode_tags(ep.themes),
+                    ep.episode_type,
+                    ep.difficulty,
+                    ep.ludicrea_relevance,
+                    embedding.astype(EMBEDDING_DTYPE).tobytes(),
+                )
+                for ep, embedding in zip(pending, embeddings)
+            ])
+            cursor.executemany(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                [
+                    ("dim", str(embeddings.shape[1])),
+                    ("dtype", np.dtype(EMBEDDING_DTYPE).name),
+                ],
+            )
+            log.info(f"   {len(pending)} 件 × {embeddings.shape[1]}次元 Embedding")
 
         conn.commit()
         conn.close()
         log.info(f"✅ Embedding生成・キャッシュ完了")
 
+        self.export_embedding_matrix()
+
+    def export_embedding_matrix(self):
+        """
+        SQLite の Embedding を1つの行列ファイル（.npy）に書き出す
+
+        行は load_episodes_with_matrix と同じ並び（Embedding が無いエピソードは0ベクトル）で、
+        正規化済みの float32 なので、起動時は mmap した行列をそのまま推薦に使える。
+        notion_id → 行番号は embedding_rows テーブルに保存する
+        """
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT notion_id, embedding FROM episodes ORDER BY title"
+        ).fetchall()
+        dim, dtype = self.load_meta(conn)
+
+        matrix = stack_embeddings([
+            decode_embedding(embedding_bytes, dim, dtype) if embedding_bytes else None
+            for _, embedding_bytes in rows
+        ], dim)
+
+        # 一時ファイルに書いてから置き換える（読み込み中のプロセスが壊れた行列を見ないように）
+        with open(f"{self.matrix_path}.tmp", "wb") as f:
+            np.save(f, matrix)
+        os.replace(f"{self.matrix_path}.tmp", self.matrix_path)
+
+        with conn:
+            conn.execute("DELETE FROM embedding_rows")
+            conn.executemany(
+                "INSERT INTO embedding_rows (notion_id, row) VALUES (?, ?)",
+                [(notion_id, i) for i, (notion_id, _) in enumerate(rows)],
+            )
+        conn.close()
+
+        log.info(f"💾 Embedding行列を書き出し: {matrix.shape} → {self.matrix_path}")
+
+    def load_embedding_matrix(self) -> Optional[np.ndarray]:
+        """Embedding 行列を mmap で開く（ファイルが無ければ None）"""
+        try:
+            return np.load(self.matrix_path, mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+
     def load_all_episodes(self) -> List[Episode]:
-        """キャッシュからすべてのエピソードを読み込み"""
-        conn = sqlite3.connect(self.db_path)
+        """キャッシュからすべてのエピソードを Full Log 込みで読み込み（管理・デバッグ用）"""
+        return self.load_episodes_with_matrix(with_full_log=True)[0]
+
+    def load_episodes_with_matrix(
+        self, with_full_log: bool = False
+    ) -> Tuple[List[Episode], np.ndarray]:
+        """
+        キャッシュからすべてのエピソードと、その並びの正規化済み Embedding 行列を読み込み
+
+        行列ファイルがエピソードの並びと一致していれば mmap をそのまま返し、
+        一致しなければ（書き出し後に DB が更新された等）読み込んだ Embedding から組み直す。
+        full_log は推薦に使わないので、with_full_log=False なら読まない
+        """
+        conn = self._connect()
         cursor = conn.cursor()
 
-        cursor.execute("SELECT * FROM episodes ORDER BY title")
+        full_log_column = "full_log" if with_full_log else "''"
+        cursor.execute(f"""
+            SELECT notion_id, title, url, summary, {full_log_column}, philosophers, themes,
+                   episode_type, difficulty, ludicrea_relevance, embedding
+            FROM episodes ORDER BY title
+        """)
         rows = cursor.fetchall()
+        matrix_rows = dict(cursor.execute("SELECT notion_id, row FROM embedding_rows"))
+        dim, dtype = self.load_meta(conn)
         conn.close()
 
+        matrix = self.load_embedding_matrix()
+        if matrix is None:
+            matrix_rows = {}
+        aligned = matrix is not None and len(matrix) == len(rows)
+
         episodes = []
-        for row in rows:
+        for i, row in enumerate(rows):
             notion_id, title, url, summary, full_log, philosophers, themes, \
-            episode_type, difficulty, ludicrea_relevance, embedding_bytes, _ = row
+            episode_type, difficulty, ludicrea_relevance, embedding_bytes = row
 
+            # mmap した行列の行（ビュー）を優先し、行列に無ければ BLOB から読む
             embedding = None
+            matrix_row = matrix_rows.get(notion_id)
+            aligned = aligned and matrix_row == i
             if embedding_bytes:
-                embedding = np.frombuffer(embedding_bytes, dtype=np.float32)
+                if matrix_row is not None and matrix_row < len(matrix):
+                    embedding = matrix[matrix_row]
+                else:
+                    embedding = decode_embedding(embedding_bytes, dim, dtype)
 
             ep = Episode(
                 notion_id=notion_id,
@@ -327,8 +600,8 @@ class EmbeddingCache:
                 url=url,
                 summary=summary,
                 full_log=full_log,
-                philosophers=json.loads(philosophers) if philosophers else [],
-                themes=json.loads(themes) if themes else [],
+                philosophers=decode_tags(philosophers),
+                themes=decode_tags(themes),
                 episode_type=episode_type,
                 difficulty=difficulty,
                 ludicrea_relevance=ludicrea_relevance,
@@ -336,8 +609,103 @@ class EmbeddingCache:
             )
             episodes.append(ep)
 
+        if not aligned:
+            matrix = stack_embeddings([ep.embedding for ep in episodes], dim)
+
         log.info(f"📦 キャッシュから {len(episodes)} 件読み込み")
-        return episodes
+        return episodes, matrix
+
+
+# ════════════════════════════════════════════════════════════════════════════
+# キーワード検索（Level 2 フォールバック。recommend_engine と app_v2 で共用）
+# ════════════════════════════════════════════════════════════════════════════
+
+def build_search_text(episodes: List[Episode]) -> Tuple[str, List[int]]:
+    """
+    タイトル・要約を1回だけ小文字化して1本の文字列にまとめる
+
+    戻り値は (各エピソードの「タイトル NUL 要約 NUL」を連結した文字列, 各エピソードの開始位置)。
+    開始位置は bisect で検索位置 → エピソード番号に戻すのに使う
+    """
+    parts = []
+    starts = []
+    offset = 0
+    for ep in episodes:
+        part = f"{ep.title.lower()}\0{ep.summary.lower()}\0"
+        starts.append(offset)
+        parts.append(part)
+        offset += len(part)
+    return "".join(parts), starts
+
+
+def search_episodes(search_text: str, starts: List[int], search_lower: str) -> List[int]:
+    """タイトルまたは要約に search_lower を含むエピソードの行番号（昇順）"""
+    if "\0" in search_lower:
+        return []
+    hits = []
+    pos = search_text.find(search_lower)
+    while pos != -1:
+        i = bisect.bisect_right(starts, pos) - 1
+        hits.append(i)
+        # 同じエピソード内の2件目以降は不要なので次のエピソードから探す
+        if i + 1 >= len(starts):
+            break
+        pos = search_text.find(search_lower, starts[i + 1])
+    return hits
+
+
+# ════════════════════════════════════════════════════════════════════════════
+# プロセス内キャッシュ（モデル・エピソード・Embedding行列は呼び出しをまたいで共有）
+# ════════════════════════════════════════════════════════════════════════════
+
+_MODEL = None
+# lru_cache は同時の初回呼び出しを止めないので、読み込み（数百MB）は1スレッドだけが行う
+_MODEL_LOCK = threading.Lock()
+
+
+def _get_model():
+    """
+    Embedding モデル（プロセス内で1回だけ読み込む）
+
+    int8 量子化した ONNX モデルが書き出してあれば ONNX Runtime で推論し、
+    無ければ SentenceTransformer（PyTorch）を使う
+    """
+    global _MODEL
+    if _MODEL is None:
+        with _MODEL_LOCK:
+            if _MODEL is None:
+                if OnnxEncoder.available():
+                    log.info("⚡ ONNX Runtime（int8）エンコーダを使用")
+                    _MODEL = OnnxEncoder()
+                else:
+                    _MODEL = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    return _MODEL
+
+
+@functools.lru_cache(maxsize=1)
+def _get_episodes_cached() -> Tuple[List[Episode], np.ndarray]:
+    """キャッシュ済みの全エピソードと、正規化済み Embedding 行列"""
+    return EmbeddingCache().load_episodes_with_matrix()
+
+
+@functools.lru_cache(maxsize=1)
+def _get_search_text() -> Tuple[str, List[int]]:
+    """キーワード検索用：全エピソードの小文字化済み検索文字列と開始位置（build_search_text）"""
+    episodes, _ = _get_episodes_cached()
+    return build_search_text(episodes)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_engine() -> "RecommendationEngine":
+    """キャッシュ済みエピソードから作った推薦エンジン（タグ行列の構築も1回だけ）"""
+    return RecommendationEngine(*_get_episodes_cached())
+
+
+def reload():
+    """エピソードのキャッシュを破棄する（次の呼び出しで SQLite から読み直す）"""
+    _get_episodes_cached.cache_clear()
+    _get_search_text.cache_clear()
+    _get_engine.cache_clear()
 
 
 # ════════════════════════════════════════════════════════════════════════════
@@ -347,15 +715,42 @@ class EmbeddingCache:
 class RecommendationEngine:
     """ユーザー入力 → 推薦エピソード"""
 
-    def __init__(self, episodes: List[Episode]):
+    def __init__(
+        self,
+        episodes: List[Episode],
+        embedding_matrix: Optional[np.ndarray] = None,
+    ):
         self.episodes = episodes
-        self.model = SentenceTransformer(EMBEDDING_MODEL_NAME)
 
-        # Embeddingをnumpy配列に統合
-        self.embedding_matrix = np.array([
-            ep.embedding if ep.embedding is not None else np.zeros(384)
-            for ep in episodes
-        ])
+        # 推薦対象は Embedding のあるエピソードだけ（0ベクトルの行に内積を計算しない）
+        valid = [i for i, ep in enumerate(episodes) if ep.embedding is not None]
+        self._valid_episodes = [episodes[i] for i in valid]
+
+        # Embeddingをnumpy配列に統合（構築済みの行列があれば有効な行だけを使う）
+        # → クエリごとのコサイン類似度は行列×ベクトルの内積1回で済む
+        if embedding_matrix is None:
+            embedding_matrix = stack_embeddings([ep.embedding for ep in self._valid_episodes])
+        elif len(valid) < len(episodes):
+            embedding_matrix = np.ascontiguousarray(embedding_matrix[valid])
+        self.embedding_matrix = embedding_matrix
+
+        # タグブースト用：(有効件数, タグ数) の bool 行列（タグ → 列番号）
+        self._phil_vocab, self._phil_mask = build_tag_mask(
+            [ep.philosophers for ep in self._valid_episodes]
+        )
+        self._theme_vocab, self._theme_mask = build_tag_mask(
+            [ep.themes for ep in self._valid_episodes]
+        )
+
+    @property
+    def model(self):
+        """Embedding モデル（EmbeddingCache と共有。recommend を呼ぶまで読み込まない）"""
+        return _get_model()
+
+    @staticmethod
+    def _tag_cols(vocab: Dict[str, int], query: Optional[List[str]]) -> np.ndarray:
+        """クエリのタグに対応する列番号"""
+        return np.array([vocab[tag] for tag in query or [] if tag in vocab], dtype=np.intp)
 
     def recommend(
         self,
@@ -379,39 +774,32 @@ class RecommendationEngine:
         if not questions:
             log.warning("質問が空です")
             return []
+        if not self._valid_episodes:
+            log.warning("Embedding のあるエピソードがありません")
+            return []
 
         # ユーザー入力をEmbedding化
         user_text = " ".join(questions)
-        user_embedding = self.model.encode(user_text, convert_to_numpy=True)
-
-        # コサイン類似度を計算
-        similarities = cosine_similarity(
-            user_embedding.reshape(1, -1),
-            self.embedding_matrix,
-        ).flatten()
-
-        # タグマッチングでブースト
-        boosts = np.ones(len(self.episodes))
-
-        if philosopher_boosts:
-            for i, ep in enumerate(self.episodes):
-                if any(p in ep.philosophers for p in philosopher_boosts):
-                    boosts[i] *= 1.2  # 20% ブースト
-
-        if theme_boosts:
-            for i, ep in enumerate(self.episodes):
-                if any(t in ep.themes for t in theme_boosts):
-                    boosts[i] *= 1.2
-
-        # スコア = 類似度 × タグブースト
-        scores = similarities * boosts
+        with inference_mode():
+            user_embedding = self.model.encode(
+                user_text, convert_to_numpy=True, normalize_embeddings=True
+            )
 
-        # 上位k件を取得
-        top_indices = np.argsort(scores)[::-1][:top_k]
+        # コサイン類似度（両方とも単位ベクトルなので内積そのもの）× タグブースト
+        # → 上位k件の選択までを recommend_kernel で1回の走査にまとめる
+        top_indices, top_scores = score_and_topk(
+            np.asarray(self.embedding_matrix),
+            user_embedding.astype(np.float32),
+            self._phil_mask,
+            self._theme_mask,
+            self._tag_cols(self._phil_vocab, philosopher_boosts),
+            self._tag_cols(self._theme_vocab, theme_boosts),
+            top_k,
+        )
 
         results = [
-            (self.episodes[idx], float(scores[idx]))
-            for idx in top_indices
+            (self._valid_episodes[idx], float(score))
+            for idx, score in zip(top_indices, top_scores)
         ]
 
         return results
@@ -431,6 +819,7 @@ def init_cache():
     # Embeddingを生成・キャッシュ
     cache = EmbeddingCache()
     cache.generate_and_cache_embeddings(episodes)
+    reload()
 
     log.info("✅ 初期化完了")
 
@@ -451,16 +840,17 @@ def get_episodes(
     Returns:
         (エピソードリスト, フォールバックレベル)
     """
-    cache = EmbeddingCache()
-    episodes = cache.load_all_episodes()
+    episodes, matrix = _get_episodes_cached()
     
+    # 候補はエピソードの行番号で扱う（Embedding 行列の行と同じ並び）
     fallback_level = 0
-    candidates = episodes
+    all_rows = range(len(episodes))
+    candidates = all_rows
     
     # Level 0: 両方マッチ（哲学者 AND テーマ）
     if philosophers and themes:
         candidates = [
-            ep for ep in episodes
+            i for i, ep in enumerate(episodes)
             if (any(p in ep.philosophers for p in philosophers)
                 and any(t in ep.themes for t in themes))
         ]
@@ -470,7 +860,7 @@ def get_episodes(
             fallback_level = 1
             # Level 1: 片方マッチ（哲学者 OR テーマ）
             candidates = [
-                ep for ep in episodes
+                i for i, ep in enumerate(episodes)
                 if (any(p in ep.philosophers for p in philosophers)
                     or any(t in ep.themes for t in themes))
             ]
@@ -478,7 +868,7 @@ def get_episodes(
     # Level 1.5: 哲学者またはテーマのいずれかのみ指定
     elif philosophers or themes:
         candidates = [
-            ep for ep in episodes
+            i for i, ep in enumerate(episodes)
             if (any(p in ep.philosophers for p in philosophers)
                 or any(t in ep.themes for t in themes))
         ]
@@ -490,43 +880,43 @@ def get_episodes(
     # Level 2: キーワード検索（サブテーマ）
     if len(candidates) < 5 and search_query:
         fallback_level = 2
-        search_lower = search_query.lower()
-        candidates = [
-            ep for ep in episodes
-            if (search_lower in ep.title.lower()
-                or search_lower in ep.summary.lower())
-        ]
+        candidates = search_episodes(*_get_search_text(), search_query.lower())
     
     # Level 3: すべてのエピソード（新しい順）
     if len(candidates) < 5:
         fallback_level = 3
-        candidates = episodes
+        candidates = all_rows
     
     # スコア計算（Embedding による類似度または新しい順）
     if search_query and candidates:
-        cache.load_model()
-        user_embedding = cache.model.encode(search_query, convert_to_numpy=True)
+        # 類似度は Embedding のある候補だけで計算し、無い候補はその後ろに回す
+        ranked = [i for i in candidates if episodes[i].embedding is not None]
+        unranked = [i for i in candidates if episodes[i].embedding is None]
         
-        scores = []
-        for ep in candidates:
-            if ep.embedding is not None:
-                sim = cosine_similarity(
-                    user_embedding.reshape(1, -1),
-                    ep.embedding.reshape(1, -1)
-                )[0, 0]
-                scores.append(float(sim))
+        if ranked:
+            with inference_mode():
+                user_embedding = _get_model().encode(
+                    search_query, convert_to_numpy=True, normalize_embeddings=True
+                )
+            u = user_embedding.astype(np.float32)
+            
+            # 読み込み済みの正規化済み行列の候補行と内積1回で類似度を計算
+            # （全件が候補のときは行を抜き出さずにそのまま掛ける）
+            if len(ranked) == len(episodes):
+                scores = matrix @ u
             else:
-                scores.append(0.0)
+                scores = matrix[ranked] @ u
+            
+            # スコア上位5件を降順で取り出す
+            ranked = [ranked[i] for i in top_k_indices(scores, 5)]
         
-        # スコア降順でソート
-        sorted_indices = np.argsort(scores)[::-1]
-        candidates = [candidates[i] for i in sorted_indices]
+        candidates = ranked + unranked
     else:
         # タグのみの場合は「新しい順」（後ろのエピソード優先）
         candidates = candidates[::-1]  # 逆順（新しい順）
     
     # 最大5個を返す
-    return candidates[:5], fallback_level
+    return [episodes[i] for i in candidates[:5]], fallback_level
 
 
 def get_recommendations(
@@ -539,10 +929,7 @@ def get_recommendations(
     【非推奨】古い推薦ロジック
     新しいコードは get_episodes() を使用してください
     """
-    cache = EmbeddingCache()
-    episodes = cache.load_all_episodes()
-
-    engine = RecommendationEngine(episodes)
+    engine = _get_engine()
     results = engine.recommend(
         questions,
         philosopher_boosts=philosopher_boosts,
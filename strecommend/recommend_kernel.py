@@ -0,0 +1,93 @@
+"""
+recommend_kernel.py
+────────────────────────────────────────────────────────────────────────────────
+推薦エンジン（RecommendationEngine.recommend）のスコアリングカーネル
+
+  • 類似度（内積）・タグブースト・上位k件の選択を1回の走査で行う
+    （スコア配列を作らず、上位k件だけを保持する）
+  • numba があれば JIT コンパイル（ディスクキャッシュあり）
+  • numba が無い環境では同じ計算を NumPy の行列積で行う
+"""
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:  # numba は任意依存
+    numba = None
+
+TAG_BOOST = 1.2  # タグが1つでもマッチしたら 20% ブースト
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """スコア上位k件のインデックスを降順で返す（全件ソートせず O(N) で選択）"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.intp)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def _score_and_topk_numpy(mat, u, phil_mask, theme_mask, phil_cols, theme_cols, k):
+    """NumPy 版: 行列積 → ブースト → argpartition"""
+    scores = mat @ u
+    boosts = np.ones(len(scores))
+    if len(phil_cols):
+        boosts[phil_mask[:, phil_cols].any(axis=1)] *= TAG_BOOST
+    if len(theme_cols):
+        boosts[theme_mask[:, theme_cols].any(axis=1)] *= TAG_BOOST
+    scores = scores * boosts
+
+    top = top_k_indices(scores, k)
+    return top, scores[top]
+
+
+if numba is not None:
+
+    # parallel=True は使わない（score_kernel.py と同じ理由: スレッドプール停止時に
+    # プロセスが終了しなくなる。数百件規模ではスレッド起動コストの方が大きい）
+    @numba.njit(cache=True, fastmath=True)
+    def _score_and_topk_numba(mat, u, phil_mask, theme_mask, phil_cols, theme_cols, k):
+        """Numba 版: エピソード（行）ごとに内積・ブーストを計算し、上位k件に挿入"""
+        n, d = mat.shape
+        k = min(k, n)
+        top = np.empty(k, dtype=np.intp)
+        top_scores = np.empty(k, dtype=np.float64)
+        filled = 0
+
+        for i in range(n):
+            s = 0.0
+            for j in range(d):
+                s += mat[i, j] * u[j]
+
+            boost = 1.0
+            for c in phil_cols:
+                if phil_mask[i, c]:
+                    boost *= TAG_BOOST
+                    break
+            for c in theme_cols:
+                if theme_mask[i, c]:
+                    boost *= TAG_BOOST
+                    break
+            s *= boost
+
+            # 上位k件（降順）への挿入。同点は先に見たエピソードを優先
+            if filled < k:
+                pos = filled
+                filled += 1
+            elif k > 0 and s > top_scores[k - 1]:
+                pos = k - 1
+            else:
+                continue
+            while pos > 0 and s > top_scores[pos - 1]:
+                top[pos] = top[pos - 1]
+                top_scores[pos] = top_scores[pos - 1]
+                pos -= 1
+            top[pos] = i
+            top_scores[pos] = s
+
+        return top, top_scores
+
+    score_and_topk = _score_and_topk_numba
+else:
+    score_and_topk = _score_and_topk_numpy